@@ -1,8 +1,9 @@
 from datetime import datetime
-import glob
+import atexit
 from logging import Formatter, handlers, StreamHandler, getLogger, DEBUG, WARN, INFO
-import inspect
 import os
+import queue
+import threading
 import time
 from datetime import datetime
 
@@ -12,24 +13,14 @@ import coloredlogs
 timestamp = datetime.strftime(datetime.now(), '%Y%m%d%H%M%S')
 LOG_FILE_NAME = f'ticker_{timestamp}.log'  # logファイルの名前
 
-class Logger:
-    def __init__(self, *, log_folder_path='log',log_level=DEBUG, log_stdout=True):
-        self.log_folder_path = log_folder_path  # logフォルダのパス
-        self.log_backupcount = 2
-
-        # logフォルダが無ければ作成
-        os.makedirs(self.log_folder_path, exist_ok=True)
-        self.log_file_path = os.path.join(self.log_folder_path, LOG_FILE_NAME)
-
-
-        coloredlogs.CAN_USE_BOLD_FONT = True
-        coloredlogs.DEFAULT_FIELD_STYLES = {'asctime': {'color': 'green'},
+coloredlogs.CAN_USE_BOLD_FONT = True
+coloredlogs.DEFAULT_FIELD_STYLES = {'asctime': {'color': 'green'},
                                     'hostname': {'color': 'magenta'},
                                     'levelname': {'color': 'blue', 'bold': True},
                                     'name': {'color': 'blue'},
                                     'programname': {'color': 'cyan'}
                                     }
-        coloredlogs.DEFAULT_LEVEL_STYLES = {'critical': {'color': 'red', 'bold': True},
+coloredlogs.DEFAULT_LEVEL_STYLES = {'critical': {'color': 'red', 'bold': True},
                                     'error': {'color': 'red'},
                                     'warning': {'color': 'yellow'},
                                     'notice': {'color': 'magenta'},
@@ -40,40 +31,107 @@ class Logger:
                                     'verbose': {'color': 'blue'}
                                     }
 
-        fsplits = inspect.stack()[1].filename.split('/')
-        name = fsplits[len(fsplits)-1]
 
-        # ロガー生成
-        self.logger = getLogger(name)
+class FastRotatingFileHandler(handlers.RotatingFileHandler):
+    """書き込んだバイト数をメモリ上で数えるRotatingFileHandler。ローテーション判定の度にファイルサイズを確認しない"""
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, **kwargs)
+        self._bytes_written = os.path.getsize(self.baseFilename) if os.path.exists(self.baseFilename) else 0
+        self._record_size = 0
+
+    def shouldRollover(self, record):
+        if self.maxBytes <= 0:
+            return False
+        msg = self.format(record) + self.terminator
+        self._record_size = len(msg.encode(self.encoding or 'utf-8'))
+        return self._bytes_written + self._record_size >= self.maxBytes
+
+    def doRollover(self):
+        super().doRollover()
+        self._bytes_written = 0
+
+    def emit(self, record):
+        super().emit(record)
+        self._bytes_written += self._record_size
+
+
+class LocalQueueHandler(handlers.QueueHandler):
+    """同一プロセス内のキューにLogRecordをそのまま渡すQueueHandler。tracebackの整形は出力側のFormatterに任せ、出力のレイアウトを変えない"""
+    def prepare(self, record):
+        return record
+
+
+class Logger:
+    def __init__(self, *, log_folder_path='log',log_level=DEBUG, log_stdout=None):
+        # 標準出力へのログ出力の有無。指定が無い場合は環境変数TICKER_STDOUTが'1' (デフォルト) のとき出力
+        if log_stdout is None:
+            log_stdout = os.environ.get('TICKER_STDOUT', '1') == '1'
+        self.log_folder_path = log_folder_path  # logフォルダのパス
+        self.log_backupcount = 2
+
+        # logフォルダが無ければ作成
+        os.makedirs(self.log_folder_path, exist_ok=True)
+        self.log_file_path = os.path.join(self.log_folder_path, LOG_FILE_NAME)
+
+        # ロガー生成。呼び出し元のファイル名はstacklevelで解決したfilenameとして出力
+        self.logger = getLogger('ticker')
         self.logger.setLevel(log_level)
-        formatter = Formatter(fmt="%(asctime)s.%(msecs)03d %(levelname)7s %(message)s [%(name)s]",
+        formatter = Formatter(fmt="%(asctime)s.%(msecs)03d %(levelname)7s %(message)s [%(filename)s]",
                                 datefmt="%Y/%m/%d %H:%M:%S")
 
         # サイズローテーション
-        handler = handlers.RotatingFileHandler(filename=self.log_file_path,
-                                               encoding='UTF-8',
-                                               maxBytes=16777216,  # 2**24 (16MB)
-                                               backupCount=self.log_backupcount)
+        handler = FastRotatingFileHandler(filename=self.log_file_path,
+                                          encoding='UTF-8',
+                                          maxBytes=16777216,  # 2**24 (16MB)
+                                          backupCount=self.log_backupcount)
 
         # ログファイル設定
         handler.setLevel(log_level)
         handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
+        output_handlers = [handler]
         # 標準出力用 設定
         if log_stdout:
-            coloredlogs.install(level=log_level, logger=self.logger, fmt=formatter._fmt, datefmt=formatter.datefmt)
+            stream_handler = StreamHandler()
+            stream_handler.setLevel(log_level)
+            if coloredlogs.terminal_supports_colors(stream_handler.stream):
+                stream_handler.setFormatter(coloredlogs.ColoredFormatter(fmt=formatter._fmt, datefmt=formatter.datefmt))
+            else:
+                stream_handler.setFormatter(formatter)
+            output_handlers.append(stream_handler)
+
+        # ファイル・標準出力への書き込みはバックグラウンドのスレッドで行い、呼び出し元をブロックしない
+        log_queue = queue.Queue(-1)
+        self.logger.addHandler(LocalQueueHandler(log_queue))
+        self.listener = handlers.QueueListener(log_queue, *output_handlers, respect_handler_level=True)
+        self._listener_lock = threading.Lock()  # flushとcloseが別スレッドから同時に呼ばれても停止・再開が競合しないようにする
+        self.listener.start()
+        atexit.register(self.close)
 
 
     def debug(self, msg):
-        self.logger.debug(msg)
+        self.logger.debug(msg, stacklevel=2)
     def info(self, msg):
-        self.logger.info(msg)
+        self.logger.info(msg, stacklevel=2)
     def warn(self, msg):
-        self.logger.warning(msg)
+        self.logger.warning(msg, stacklevel=2)
     def error(self, msg, *, exc_info=True):
-        self.logger.error(msg, exc_info=exc_info)
+        self.logger.error(msg, exc_info=exc_info, stacklevel=2)
     def critical(self, msg):
-        self.logger.critical(msg)
+        self.logger.critical(msg, stacklevel=2)
+
+    def flush(self):
+        """キューに残っているログを書き出す。バックグラウンドのスレッドを一度停止して書き出しを待ち、再開する"""
+        with self._listener_lock:
+            if self.listener is not None:
+                self.listener.stop()
+                self.listener.start()
+
+    def close(self):
+        """キューに残っているログを書き出し、バックグラウンドのスレッドを停止"""
+        with self._listener_lock:
+            if self.listener is not None:
+                self.listener.stop()
+                self.listener = None
 
     def remove_oldlog(self, *, max_log_num=30):
         """古いlogファイルを消去
@@ -83,16 +141,28 @@ class Logger:
         max_log_num : int, optional
             logファイルの最大件数, by default 30
         """
-        logfile_name = os.path.join(self.log_folder_path, '*.log')
-        logs = glob.glob(logfile_name)
-        if len(logs) > max_log_num:
-            log_list = [[log, datetime.strptime(log[-18:-4], '%Y%m%d%H%M%S')] for log in logs]
-            log_list = sorted(log_list, key=lambda s: s[1])
-            remove_log_path = log_list[0][0]
-            self.info(f'remove {remove_log_path}')
-            os.remove(remove_log_path)
-
-            for i in range(1, self.log_backupcount+1):
-                remove_rotating_log_path = remove_log_path + f'.{i}'
-                if os.path.exists(remove_rotating_log_path):
-                    os.remove(remove_rotating_log_path)
\ No newline at end of file
+        with os.scandir(self.log_folder_path) as it:
+            filenames = [entry.name for entry in it]
+        logs = [filename for filename in filenames if filename.endswith('.log')]
+        if len(logs) <= max_log_num:
+            return
+        # ファイル名の日時は%Y%m%d%H%M%S形式のため、文字列のソートで古い順になる
+        remove_log = min(logs)
+        remove_log_path = os.path.join(self.log_folder_path, remove_log)
+        self.info(f'remove {remove_log_path}')
+        os.remove(remove_log_path)
+
+        # ローテーションされたlogファイル (*.log.1, *.log.2, ...) も消去
+        for filename in filenames:
+            if filename.startswith(remove_log + '.'):
+                os.remove(os.path.join(self.log_folder_path, filename))
+
+
+_logger = None
+
+def get_logger() -> Logger:
+    """プロセスで共有するLoggerを返す。初回の呼び出し時に生成"""
+    global _logger
+    if _logger is None:
+        _logger = Logger()
+    return _logger
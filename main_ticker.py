@@ -1,13 +1,20 @@
 import asyncio
 
+try:
+    import uvloop
+except ImportError:  # Windowsなどuvloopが使えない環境では標準のイベントループを使用
+    uvloop = None
+
 from trading_api.trading_api import ApiClient
-from logger import Logger
+from logger import get_logger
 
-logger = Logger()
+logger = get_logger()
 logger.remove_oldlog()
 
 
 if __name__ == '__main__':
+    if uvloop is not None:
+        uvloop.install()  # イベントループをlibuvベースのuvloopに置き換え
     try:
         logger.info('####### START #######')
         api_client : ApiClient = ApiClient()
@@ -20,5 +27,5 @@ if __name__ == '__main__':
         logger.error(e)
         
     finally:
-        api_client.save_ticker()
+        asyncio.run(api_client.save_ticker())
         logger.info('######## END ########')
\ No newline at end of file
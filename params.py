@@ -23,6 +23,8 @@ COLUMNS = [
 SECRET_KET_PATH = 'secret_key.json'  # GCPのsecret_keyのpath
 BAKET_NAME = 'trading_datas_storage'
 SAVE_DIR = 'trading_datas'
+SAVE_FORMAT = 'pickle'  # 保存形式。'pickle' (zstd圧縮) または 'parquet' (列指向、pyarrowが必要。orderbookのlistはndarrayとして読み込まれる)
+UPLOAD_RETRY_INTERVAL = 600  # GCSへのアップロードに失敗した際に、再試行するまでの秒数
 os.makedirs(SAVE_DIR, exist_ok=True)
 
 BYBIT = 'bybit'
@@ -53,13 +55,5 @@ SEND_JSONS = {
         'op': 'subscribe', 
         'args': ['orderBookL2_25:XBTUSD', 'trade:XBTUSD']}}
 
-TRADE_IDS = {
-    BYBIT: 'trade_id',
-    FTX: 'time',
-    BITMEX: 'trdMatchID'}
-
-LIQUIDATION_IDS = {
-    BYBIT: 'time'}
-
 OI_IDS = {
     BYBIT: 'open_interest'}
\ No newline at end of file
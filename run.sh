@@ -1,3 +1,3 @@
 #!/bin/bash
 
-nohup python main_ticker.py > .nohup.txt &
\ No newline at end of file
+TICKER_STDOUT=0 nohup python main_ticker.py > .nohup.txt &
\ No newline at end of file
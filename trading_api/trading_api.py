@@ -1,56 +1,46 @@
-from typing import List, Dict, Optional, Tuple, Any, Union
+from typing import List, Dict, Optional, Tuple, Any, Union, Callable, Awaitable
 import os
-import sys
-import json
+import io
+import time
 from datetime import date, datetime
-from copy import deepcopy
+from array import array
+from operator import itemgetter
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import asyncio
 
+import numpy as np
 import pandas as pd
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjsonが無い環境では標準のjsonでデコード
+    from json import loads as json_loads
 import pybotters
-from pybotters.store import DataStoreManager
+from pybotters.store import DataStore, DataStoreManager
 from google.cloud import storage
 from google.oauth2.service_account import Credentials
 
 import params
-from utils.utils import extract_dict
-from logger import Logger
+from logger import get_logger
 
 
-logger = Logger()
+logger = get_logger()
 
-
-class ContractPrice:
-    """約定の情報をもつクラス
-
-    Attributes
-    ----------
-    side : str = 'buy' | 'sell'
-        約定のside
-    price : float
-        約定価格
-    """
-    def __init__(self, side: str, price: float) -> None:
-        self.side : str = side
-        self.price : float = price
+# 約定・清算のsideの表記 (取引所により大文字・小文字が異なる) を、買い: 1, 売り: 0 に変換するdict
+SIDE_MAP : Dict[str, int] = {
+    'buy': 1, 'Buy': 1, 'BUY': 1,
+    'sell': 0, 'Sell': 0, 'SELL': 0}
 
 
 class TradingHistoryStorage:
     """約定履歴を保持するクラス
 
-    ClassAttributes
-    ---------------
-    trade_ids_dict : Dict[str, Any | None]
-        取引所をkey, トレードのidをvalueとするdict。
-        新たなトレードが行われたか判定するために使用
-    liquidation_ids_dict : Dict[str, Any | None]
-        取引所をkey, 清算のidをvalueとするdict。
-        新たな清算が行われたか判定するために使用
-
     Attributes
     ----------
-    contract_prices : Dict[str, List[float]]
-        取引所をkey, 約定価格をvalueとするdict
+    prices_dict : Dict[str, array]
+        取引所をkey, 約定価格を約定順に並べたarray('d')をvalueとするdict
+    sides_dict : Dict[str, array]
+        取引所をkey, 約定のside (買い: 1, 売り: 0) を約定順に並べたarray('b')をvalueとするdict
     buy_volume_dict : Dict[str, float]
         取引所をkey, 買いの約定数をvalueとするdict
     sell_volume_dict : Dict[str, float]
@@ -62,14 +52,18 @@ class TradingHistoryStorage:
     OIids_dict : Dict[str, Any | None]
         取引所をkey, 未決済建玉のidをvalueとするdict。
         未決済建玉が更新されたか判定するために使用（※未決済建玉数をidをしているためインスタンス変数としている）
-    OIs_dict : Dict[str, List[float]]
-        取引所をkey, 未決済建玉数をvalueとするdict
+    OIs_dict : Dict[str, array]
+        取引所をkey, 未決済建玉数を更新順に並べたarray('d')をvalueとするdict
+
+    Methods
+    -------
+    reset -> None
+        保持している約定履歴を空にする
     """
-    trade_ids_dict : Dict[str, Optional[Any]] = {exchange: None for exchange in params.EXCHANGES}
-    liquidation_ids_dict : Dict[str, Optional[Any]] = {exchange: None for exchange in params.EXCHANGES}
     def __init__(self) -> None:
         # trade
-        self.contract_prices_dict : Dict[str, List[ContractPrice]] = {exchange: [] for exchange in params.EXCHANGES}
+        self.prices_dict : Dict[str, array] = {exchange: array('d') for exchange in params.EXCHANGES}
+        self.sides_dict : Dict[str, array] = {exchange: array('b') for exchange in params.EXCHANGES}
         self.buy_volume_dict : Dict[str, float] = {exchange: 0.0 for exchange in params.EXCHANGES}
         self.sell_volume_dict : Dict[str, float] = {exchange: 0.0 for exchange in params.EXCHANGES}
         # liquidation
@@ -77,7 +71,22 @@ class TradingHistoryStorage:
         self.sell_liquidation_qty_dict : Dict[str, float] = {exchange: 0.0 for exchange in params.EXCHANGES}
         # OI
         self.OIids_dict : Dict[str, Optional[Any]] = {exchange: None for exchange in params.EXCHANGES}
-        self.OIs_dict : Dict[str, List[float]] = {exchange: [] for exchange in params.EXCHANGES}
+        self.OIs_dict : Dict[str, array] = {exchange: array('d') for exchange in params.EXCHANGES}
+
+    def reset(self) -> None:
+        """保持している約定履歴を空にする。新たなインスタンスは作らず、各arrayとdictをその場で初期化する"""
+        for exchange in params.EXCHANGES:
+            # trade
+            del self.prices_dict[exchange][:]
+            del self.sides_dict[exchange][:]
+            self.buy_volume_dict[exchange] = 0.0
+            self.sell_volume_dict[exchange] = 0.0
+            # liquidation
+            self.buy_liquidation_qty_dict[exchange] = 0.0
+            self.sell_liquidation_qty_dict[exchange] = 0.0
+            # OI
+            self.OIids_dict[exchange] = None
+            del self.OIs_dict[exchange][:]
 
 
 class Ohlcv:
@@ -101,29 +110,72 @@ class Ohlcv:
         買い値の平均値
     sell_price_avg : float | None
         売り値の平均値
+
+    ClassAttributes
+    ---------------
+    SMALL_WINDOW : int
+        この約定数未満の場合はnumpyを使わずに集計する
     """
+    SMALL_WINDOW : int = 32
+
+    __slots__ = (
+        'open',
+        'high',
+        'low',
+        'close',
+        'buy_volume',
+        'sell_volume',
+        'buy_price_avg',
+        'sell_price_avg')
+
     def __init__(
             self, 
-            cps: Optional[List[ContractPrice]] = None,
+            prices: Optional[array] = None,
+            sides: Optional[array] = None,
             buy_volume: float = 0.0,
             sell_volume: float = 0.0) -> None:
-        self.open : Optional[float] = cps[0].price if cps is not None else None
-        self.high : Optional[float] = max([cp.price for cp in cps]) if cps is not None else None
-        self.low : Optional[float] = min([cp.price for cp in cps]) if cps is not None else None
-        self.close : Optional[float] = cps[-1].price if cps is not None else None
         self.buy_volume : float = buy_volume
         self.sell_volume : float = sell_volume
-        try:
-            self.buy_price_avg : Optional[float] = sum([cp.price for cp in cps if cp.side == 'buy']) / buy_volume if cps is not None else None
-        except ZeroDivisionError:
+        if prices is None:  # 約定が一つも無かった場合
+            self.open : Optional[float] = None
+            self.high : Optional[float] = None
+            self.low : Optional[float] = None
+            self.close : Optional[float] = None
             self.buy_price_avg : Optional[float] = None
-        try:
-            self.sell_price_avg : Optional[float] = sum([cp.price for cp in cps if cp.side == 'sell']) / sell_volume if cps is not None else None
-        except ZeroDivisionError:
             self.sell_price_avg : Optional[float] = None
+            return None
+
+        if len(prices) < self.SMALL_WINDOW:
+            # 約定数が少ない場合はnumpyの呼び出しコストの方が大きいため、１回のループで高値、安値、買い値と売り値の合計を求める
+            high : float = prices[0]
+            low : float = prices[0]
+            buy_price_sum : float = 0.0
+            sell_price_sum : float = 0.0
+            for price, side in zip(prices, sides):
+                if price > high:
+                    high = price
+                elif price < low:
+                    low = price
+                if side == 1:
+                    buy_price_sum += price
+                else:
+                    sell_price_sum += price
+        else:
+            # arrayのバッファをコピーせずにndarrayとして参照し、集計をnumpyで行う
+            price_arr : np.ndarray = np.frombuffer(prices, dtype=np.float64)
+            high : float = float(price_arr.max())
+            low : float = float(price_arr.min())
+            buy_price_sum : float = float(price_arr[np.frombuffer(sides, dtype=np.int8) == 1].sum())
+            sell_price_sum : float = float(price_arr.sum()) - buy_price_sum  # 売りはマスクせず全体との差で求める
+        self.open : Optional[float] = prices[0]
+        self.high : Optional[float] = high
+        self.low : Optional[float] = low
+        self.close : Optional[float] = prices[-1]
+        self.buy_price_avg : Optional[float] = buy_price_sum / buy_volume if buy_volume != 0 else None
+        self.sell_price_avg : Optional[float] = sell_price_sum / sell_volume if sell_volume != 0 else None
 
     def __str__(self) -> str:
-        return str(self.__dict__)
+        return str({name: getattr(self, name) for name in self.__slots__})
 
 
 class LiquidationQty:
@@ -136,6 +188,8 @@ class LiquidationQty:
     sell_liq_qty : float
         売りの精算数
     """
+    __slots__ = ('buy_liq_qty', 'sell_liq_qty')
+
     def __init__(self, buy_liq_qty: float, sell_liq_qty: float) -> None:
         self.buy_liq_qty : float = buy_liq_qty
         self.sell_liq_qty : float = sell_liq_qty
@@ -155,7 +209,9 @@ class OIohlc:
     oi_close : float | None
         未決済建玉数の終値
     """
-    def __init__(self, ois: Optional[List[float]] = None) -> None:
+    __slots__ = ('oi_open', 'oi_high', 'oi_low', 'oi_close')
+
+    def __init__(self, ois: Optional[array] = None) -> None:
         self.oi_open : Optional[float] = ois[0] if ois is not None else None
         self.oi_high : Optional[float] = max(ois) if ois is not None else None
         self.oi_low : Optional[float] = min(ois) if ois is not None else None
@@ -167,6 +223,8 @@ class Ticker:
 
     Attributes
     ----------
+    timestamp : datetime
+        取得時刻
     open : float | None
         始値
     high : float | None
@@ -197,7 +255,30 @@ class Ticker:
         未決済建玉数の終値
     orderbook : Dict[str, List[Dict[str, float]]]
         板情報
+
+    Methods
+    -------
+    as_row -> Tuple[Any, ...]
+        params.COLUMNSの順に並べたレコードを返す
     """
+    __slots__ = (
+        'timestamp',
+        'open',
+        'high',
+        'low',
+        'close',
+        'buy_volume',
+        'sell_volume',
+        'buy_price_avg',
+        'sell_price_avg',
+        'buy_liq_qty',
+        'sell_liq_qty',
+        'oi_open',
+        'oi_high',
+        'oi_low',
+        'oi_close',
+        'orderbook')
+
     def __init__(
             self,
             timestamp : datetime,
@@ -222,6 +303,111 @@ class Ticker:
         self.oi_close : Optional[float] = oi_ohlc.oi_close
         self.orderbook : Dict[str, List[Dict[str, float]]] = orderbook
 
+    def as_row(self) -> Tuple[Any, ...]:
+        """params.COLUMNSの順に並べたレコードを返す
+
+        Returns
+        -------
+        Tuple[Any, ...]
+            dfの１レコード
+        """
+        return (
+            self.timestamp,
+            self.open,
+            self.high,
+            self.low,
+            self.close,
+            self.buy_volume,
+            self.sell_volume,
+            self.buy_price_avg,
+            self.sell_price_avg,
+            self.buy_liq_qty,
+            self.sell_liq_qty,
+            self.oi_open,
+            self.oi_high,
+            self.oi_low,
+            self.oi_close,
+            self.orderbook)
+
+
+class TickerBuffer:
+    """１日分の取引情報を保持するバッファ。数値のカラムはfloat64の2次元配列に保持し、容量が足りなくなると倍に拡張する
+
+    ClassAttributes
+    ---------------
+    NUMERIC_COLUMNS : List[str]
+        数値のカラム。params.COLUMNSのtimestamp, orderbook以外
+    INITIAL_CAPACITY : int
+        初期の容量。5秒毎に取得した場合の１日分のレコード数
+
+    Attributes
+    ----------
+    timestamps : np.ndarray
+        取得時刻の配列 (datetime64[ns])
+    values : np.ndarray
+        数値のカラムの値を保持する2次元配列 (float64)。Noneはnanとして保持
+    orderbooks : List[Dict[str, List[Dict[str, float]]]]
+        板情報のlist
+    size : int
+        保持しているレコード数
+
+    Methods
+    -------
+    append -> None
+        レコードを追加
+    to_dataframe -> pd.DataFrame
+        保持しているレコードをparams.COLUMNSの順のdfに変換
+    """
+    NUMERIC_COLUMNS : List[str] = params.COLUMNS[1:-1]
+    INITIAL_CAPACITY : int = 24 * 60 * 60 // 5
+
+    def __init__(self, capacity: int = INITIAL_CAPACITY) -> None:
+        self.timestamps : np.ndarray = np.empty(capacity, dtype='datetime64[ns]')
+        self.values : np.ndarray = np.empty((capacity, len(self.NUMERIC_COLUMNS)), dtype=np.float64)
+        self.orderbooks : List[Dict[str, List[Dict[str, float]]]] = []
+        self.size : int = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, ticker: Ticker) -> None:
+        """レコードを追加
+
+        Parameters
+        ----------
+        ticker : Ticker
+            取引情報
+        """
+        if self.size == len(self.timestamps):
+            self._grow()
+        row : Tuple[Any, ...] = ticker.as_row()
+        self.timestamps[self.size] = row[0]
+        self.values[self.size] = row[1:-1]
+        self.orderbooks.append(row[-1])
+        self.size += 1
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """保持しているレコードをparams.COLUMNSの順のdfに変換
+
+        Returns
+        -------
+        pd.DataFrame
+            取引情報のdf
+        """
+        df : pd.DataFrame = pd.DataFrame(self.values[:self.size], columns=self.NUMERIC_COLUMNS)
+        df.insert(0, 'timestamp', self.timestamps[:self.size])
+        df['orderbook'] = self.orderbooks
+        return df
+
+    def _grow(self) -> None:
+        """容量を倍に拡張"""
+        capacity : int = len(self.timestamps) * 2
+        timestamps : np.ndarray = np.empty(capacity, dtype=self.timestamps.dtype)
+        timestamps[:self.size] = self.timestamps[:self.size]
+        values : np.ndarray = np.empty((capacity, self.values.shape[1]), dtype=self.values.dtype)
+        values[:self.size] = self.values[:self.size]
+        self.timestamps, self.values = timestamps, values
+
 
 class ApiClient:
     """取引所のAPIを使用するクラス
@@ -230,28 +416,43 @@ class ApiClient:
     ----------
     store_dict : Dict[str, DataStoreManager]
         取引所をkey, 対応するDataStoreをvalueとするdict
-    df_dict : Dict[str, pd.DataFrame]
-        取引所をkey, 取引情報を保持するdfをvalueとするdict
+    buffer_dict : Dict[str, TickerBuffer]
+        取引所をkey, 取引情報のレコードを溜めるバッファをvalueとするdict。保存時にまとめてdfに変換
     trading_history_storage : TradingHistoryStorage
         各取引所の約定履歴を保持するインスタンス
     warning_count : int
         エラーが生じた際にインクレメント、5を超えるとプログラムを異常終了
+    pending_buffer_dicts : Dict[date, Dict[str, TickerBuffer]]
+        日付をkey, 退避したbuffer_dictをvalueとするdict。GCSへのアップロードが成功するまで保持する
+    upload_task : asyncio.Task | None
+        退避したレコードをGCSにアップロードするタスク。タスクが破棄されないよう参照を保持する
+    upload_retry_time : float
+        アップロードに失敗した際に、次に再試行する時刻 (UNIX時間)
 
     Methods
     -------
     get_realtime_orderbook
         リアルタイムに取引情報を保存する。約定履歴は5秒ごとにohlcvにまとめ、板情報とともにdfに保存
     save_ticker -> None
-        dfを日が変わるごとにSAVE_DIRに書き出し、初期化する
+        (async) 溜めたレコードを退避・初期化し、未アップロードのレコードとともにGCSへのアップロードが完了するまで待機する。終了時に使用
+    _stash_buffers -> None
+        溜めたレコードを日付とともにpending_buffer_dictsに退避し、初期化する
+    _upload_pending -> None
+        (async) 退避したレコードを日付順に、別スレッドの_upload_tickerでアップロードする。日付が変わった際はタスクとして実行し、完了を待たない
+    _upload_ticker -> None
+        退避したレコードをdfに変換し、取引所ごとに並列でGCSにアップロードする。失敗した場合はローカルに書き出す。最後にlogファイルもアップロード
     """
     def __init__(self) -> None:
         self.store_dict : Dict[str, DataStoreManager] = {exchange: params.STORES[exchange] for exchange in params.EXCHANGES}
-        self.df_dict : Dict[str, pd.DataFrame] = {exchange: pd.DataFrame(columns=params.COLUMNS) for exchange in params.EXCHANGES}
+        self.buffer_dict : Dict[str, TickerBuffer] = {exchange: TickerBuffer() for exchange in params.EXCHANGES}
         self.today : date = datetime.now().date()
         self.trading_history_storage : TradingHistoryStorage = TradingHistoryStorage()
         self.warning_count : int = 0
+        self.pending_buffer_dicts : Dict[date, Dict[str, TickerBuffer]] = {}
+        self.upload_task : Optional[asyncio.Task] = None
+        self.upload_retry_time : float = 0.0
         # GCS設定
-        _cred : Credentials = Credentials.from_service_account_info(json.load(open(params.SECRET_KET_PATH)))
+        _cred : Credentials = Credentials.from_service_account_file(params.SECRET_KET_PATH)  # ファイルの読み込みとクローズまで行う
         self.gcs_client : storage.Client = storage.Client(credentials=_cred, project=_cred.project_id)
         self.gcs_bucket : storage.Bucket = self.gcs_client.get_bucket(params.BAKET_NAME)
 
@@ -262,29 +463,42 @@ class ApiClient:
                 await client.ws_connect(
                     url=params.URLS[exchange],
                     send_json=params.SEND_JSONS[exchange],
-                    hdlr_json=self.store_dict[exchange].onmessage)
+                    hdlr_str=self._create_ws_handler(exchange))
 
-            # 各取引所の情報が取得できるまで待機
+            # 各取引所の情報が取得できるまで待機。いずれかのDataStoreが更新されるたびに確認する
+            waiters : Dict[str, asyncio.Task] = {exchange: asyncio.create_task(self.store_dict[exchange].wait()) for exchange in params.EXCHANGES}
             while not self._has_update():
-                await asyncio.sleep(0)
+                done, _ = await asyncio.wait(waiters.values(), return_when=asyncio.FIRST_COMPLETED)
+                for exchange, waiter in waiters.items():
+                    if waiter in done:
+                        waiters[exchange] = asyncio.create_task(self.store_dict[exchange].wait())
+            for waiter in waiters.values():
+                waiter.cancel()
 
             # キリの良い時間まで待機
-            while datetime.now().second % 5 != 0:
-                await asyncio.sleep(0)
+            tick : float = self._cal_next_tick()  # 直前のtickの時刻 (UNIX時間)。次のtickはこの時刻を基準に決める
+            await asyncio.sleep(max(0.0, tick - time.time()))
 
+            # 約定履歴などを収集するタスク。例外で終了した場合はメインループで検知して作り直す
+            collectors : Dict[str, Callable[[], Awaitable[None]]] = {}
             for exchange in params.EXCHANGES:
-                asyncio.create_task(self._store_trading_history(exchange=exchange))
+                collectors[f'trades_{exchange}'] = partial(self._store_trades, exchange=exchange)
+                collectors[f'liquidations_{exchange}'] = partial(self._store_liquidations, exchange=exchange)
+            collectors['open_interest'] = self._store_open_interest
+            collector_tasks : Dict[str, asyncio.Task] = {name: asyncio.create_task(collector()) for name, collector in collectors.items()}
 
-            await asyncio.sleep(5)  # 約定情報を貯める
+            # 約定情報を貯める
+            tick = self._cal_next_tick(last_tick=tick)
+            await asyncio.sleep(max(0.0, tick - time.time()))
 
             while True:
                 try:
-                    timestamp : datetime = datetime.now()
+                    timestamp : datetime = datetime.fromtimestamp(tick)  # 起床が早まっても、行の時刻はtickの境界に揃える
                     # subprocessで動いているトレード情報を収集
                     ohlcv_dict : Dict[str, Ohlcv] = self._create_ohlcvs()
                     liquidation_qty_dict : Dict[str, LiquidationQty] = self._create_liquidation_qty()
                     oi_ohlc_dict : Dict[str, OIohlc] = self._create_oi_ohlc()
-                    self.trading_history_storage : TradingHistoryStorage = TradingHistoryStorage()  # 約定履歴ストレージのリセット
+                    self.trading_history_storage.reset()  # 約定履歴ストレージのリセット
                     # 各取引所のticker情報を保存
                     ticker_dict : Dict[str, Ticker] = {}
                     for exchange in params.EXCHANGES:
@@ -297,86 +511,147 @@ class ApiClient:
                             orderbook=self._parse_orderbook(orderbook))
 
                     self._update_df(now=timestamp.date(), ticker_dict=ticker_dict)
+                    self._restart_failed_collectors(collectors=collectors, collector_tasks=collector_tasks)
 
                     # for exchange in params.EXCHANGES:
-                    #     logger.debug(self.df_dict[exchange].tail(1))
+                    #     logger.debug(self.buffer_dict[exchange].to_dataframe().tail(1))
                     self.warning_count = 0
 
-                    # キリの良い時間まで待機
-                    await asyncio.sleep(1)
-                    while datetime.now().second % 5 != 0:
-                        await asyncio.sleep(0)
-
                 except Exception as e:
                     logger.warn(e)
                     self.warning_count += 1
                     if self.warning_count > 5:
                         raise Exception(e)
-                    # キリの良い時間まで待機
-                    while datetime.now().second % 5 != 0:
-                        await asyncio.sleep(0)
 
-    async def _store_trading_history(self, exchange: str):
-        """約定履歴をリアルタイムに保存"""
+                # 次のtickの時刻まで待機。早く起床したり例外が生じたりしても、同じ5秒間に再度tickを行わない
+                tick = self._cal_next_tick(last_tick=tick)
+                await asyncio.sleep(max(0.0, tick - time.time()))
 
-        def inner_store_trade(trades: List[Dict]) -> None:
-            """約定情報の更新時にその情報を保持する"""
-            if trades == []:
-                return None
-            latest_trade : Dict = trades[-1]
-            if latest_trade[params.TRADE_IDS[exchange]] != TradingHistoryStorage.trade_ids_dict[exchange]:
-                # トレードidが更新されていれば情報を保持
-                TradingHistoryStorage.trade_ids_dict[exchange] = latest_trade[params.TRADE_IDS[exchange]]
-                if latest_trade['side'].lower() == 'buy':
-                    self.trading_history_storage.contract_prices_dict[exchange].append(ContractPrice(side='buy', price=float(latest_trade['price'])))
-                    self.trading_history_storage.buy_volume_dict[exchange] += float(latest_trade['size'])
-                elif latest_trade['side'].lower() == 'sell':
-                    self.trading_history_storage.contract_prices_dict[exchange].append(ContractPrice(side='sell', price=float(latest_trade['price'])))
-                    self.trading_history_storage.sell_volume_dict[exchange] += float(latest_trade['size'])
-
-        def inner_store_liquidation(liquidations: List[Dict]) -> None:
-            """精算の更新時にその情報を保持する"""
-            if liquidations == []:
+    def _create_ws_handler(self, exchange: str) -> Callable[[str, Any], None]:
+        """websocketで受信した文字列をデコードし、DataStoreに渡すハンドラを作成。デコードには高速なorjsonを使用する
+
+        Parameters
+        ----------
+        exchange : str
+            取引所名
+
+        Returns
+        -------
+        Callable[[str, Any], None]
+            pybotters.Client.ws_connectのhdlr_strに渡すハンドラ
+        """
+        onmessage : Callable[[Any, Any], None] = self.store_dict[exchange].onmessage
+
+        def inner_handler(msg: str, ws: Any) -> None:
+            try:
+                data : Any = json_loads(msg)
+            except ValueError:
+                # JSONでないメッセージ (64bitを超える整数などorjsonが扱えないものも含む) はhdlr_jsonと同様に無視
+                # orjson, jsonのJSONDecodeErrorはどちらもValueErrorのサブクラス
                 return None
-            latest_liquidation : Dict = liquidations[-1]
-            if latest_liquidation[params.LIQUIDATION_IDS[exchange]] != TradingHistoryStorage.liquidation_ids_dict[exchange]:
-                # liquidation idが更新されていれば情報を保持
-                TradingHistoryStorage.liquidation_ids_dict[exchange] = latest_liquidation[params.LIQUIDATION_IDS[exchange]]
-                if latest_liquidation['side'].lower() == 'buy':
-                    self.trading_history_storage.buy_liquidation_qty_dict[exchange] += float(latest_liquidation['qty'])
-                if latest_liquidation['side'].lower() == 'sell':
-                    self.trading_history_storage.sell_liquidation_qty_dict[exchange] += float(latest_liquidation['qty'])
-
-        def inner_store_OI(OIs: List[Dict]) -> None:
+            onmessage(data, ws)
+
+        return inner_handler
+
+    async def _store_trades(self, exchange: str):
+        """約定履歴をリアルタイムに保存。前回以降にDataStoreへ追加された約定を全て取り込む"""
+        try:
+            trade_store : DataStore = self.store_dict[exchange].trade
+        except AttributeError:  # FTX用
+            trade_store : DataStore = self.store_dict[exchange].trades
+        # 約定履歴ストレージはその場でリセットされ参照が変わらないため、ループの外で一度だけ参照する
+        prices : array = self.trading_history_storage.prices_dict[exchange]
+        sides : array = self.trading_history_storage.sides_dict[exchange]
+        buy_volume_dict : Dict[str, float] = self.trading_history_storage.buy_volume_dict
+        sell_volume_dict : Dict[str, float] = self.trading_history_storage.sell_volume_dict
+
+        while True:
+            # DataStore.waitは待機を開始してから追加された約定のみを返すため、storeの全件を走査する必要が無い
+            trades : List[Dict] = await trade_store.wait()
+            for trade in trades:
+                side : Optional[int] = SIDE_MAP.get(trade['side'])
+                if side is None:
+                    continue
+                prices.append(float(trade['price']))
+                sides.append(side)
+                if side == 1:
+                    buy_volume_dict[exchange] += float(trade['size'])
+                else:
+                    sell_volume_dict[exchange] += float(trade['size'])
+
+    async def _store_liquidations(self, exchange: str):
+        """清算履歴をリアルタイムに保存。前回以降にDataStoreへ追加された清算を全て取り込む"""
+        liquidation_store : Optional[DataStore] = getattr(self.store_dict[exchange], 'liquidation', None)
+        if liquidation_store is None:  # FTX, BitMEX用 (清算のDataStoreが無い)
+            return None
+        buy_liquidation_qty_dict : Dict[str, float] = self.trading_history_storage.buy_liquidation_qty_dict
+        sell_liquidation_qty_dict : Dict[str, float] = self.trading_history_storage.sell_liquidation_qty_dict
+
+        while True:
+            liquidations : List[Dict] = await liquidation_store.wait()
+            for liquidation in liquidations:
+                side : Optional[int] = SIDE_MAP.get(liquidation['side'])
+                if side == 1:
+                    buy_liquidation_qty_dict[exchange] += float(liquidation['qty'])
+                elif side == 0:
+                    sell_liquidation_qty_dict[exchange] += float(liquidation['qty'])
+
+    async def _store_open_interest(self):
+        """未決済建玉の履歴をリアルタイムに保存。全取引所の未決済建玉のDataStoreを一つのタスクで監視する"""
+        OIids_dict : Dict[str, Optional[Any]] = self.trading_history_storage.OIids_dict
+        OIs_dict : Dict[str, array] = self.trading_history_storage.OIs_dict
+        instrument_stores : Dict[str, DataStore] = {}
+        for exchange in params.EXCHANGES:
+            instrument_store : Optional[DataStore] = getattr(self.store_dict[exchange], 'instrument', None)
+            if instrument_store is not None:  # FTX, BitMEXは未決済建玉のDataStoreが無い
+                instrument_stores[exchange] = instrument_store
+
+        def inner_store_OI(exchange: str) -> None:
             """未決済建玉の更新時にその情報を保持する"""
+            OIs : List[Dict] = instrument_stores[exchange].find()
             if OIs == []:
                 return None
-            latest_OI : Dict = OIs[-1]
-            if latest_OI[params.OI_IDS[exchange]] != self.trading_history_storage.OIids_dict[exchange]:
+            latest_OI : Any = OIs[-1][params.OI_IDS[exchange]]
+            if latest_OI != OIids_dict[exchange]:
                 # OI idが更新されていれば情報を保持
-                self.trading_history_storage.OIids_dict[exchange] = latest_OI[params.OI_IDS[exchange]]
-                self.trading_history_storage.OIs_dict[exchange].append(float(latest_OI[params.OI_IDS[exchange]]))
-            
-        while True:
-            try:
-                trades : List[Dict] = self.store_dict[exchange].trade.find()
-                liquidations : List[Dict] = self.store_dict[exchange].liquidation.find()
-                OIs : List[Dict] = self.store_dict[exchange].instrument.find()
-            except AttributeError:  # FTX用
-                trades : Dict = self.store_dict[exchange].trades.find()
-            except Exception as e:
-                logger.error(e)
-                self.save_ticker()
-                sys.exit(1)
-            try:
-                inner_store_trade(trades=trades)  # 約定情報の更新時にその情報を保持
-                inner_store_liquidation(liquidations=liquidations)  # 精算の更新時にその情報を保持
-                inner_store_OI(OIs=OIs)  # 未決済建玉の更新時にその情報を保持
-                await self.store_dict[exchange].wait()
-            except Exception as e:
-                logger.error(e)
-                self.save_ticker()
-                sys.exit(1)
+                OIids_dict[exchange] = latest_OI
+                OIs_dict[exchange].append(float(latest_OI))
+
+        # 更新のあった取引所のDataStoreのみを読み、その取引所の待機を再開する
+        waiters : Dict[str, asyncio.Task] = {
+            exchange: asyncio.create_task(instrument_store.wait()) for exchange, instrument_store in instrument_stores.items()}
+        try:
+            while waiters:
+                done, _ = await asyncio.wait(waiters.values(), return_when=asyncio.FIRST_COMPLETED)
+                for exchange, waiter in waiters.items():
+                    if waiter in done:
+                        inner_store_OI(exchange)
+                        waiters[exchange] = asyncio.create_task(instrument_stores[exchange].wait())
+        finally:  # 例外で終了する場合に待機中のタスクを残さない
+            for waiter in waiters.values():
+                waiter.cancel()
+
+    def _restart_failed_collectors(
+            self,
+            collectors: Dict[str, Callable[[], Awaitable[None]]],
+            collector_tasks: Dict[str, asyncio.Task]) -> None:
+        """例外で終了した収集タスクを作り直し、その例外を送出する。送出した例外はメインループのwarning_countで扱う
+
+        Parameters
+        ----------
+        collectors : Dict[str, Callable[[], Awaitable[None]]]
+            タスク名をkey, 収集を行うコルーチン関数をvalueとするdict
+        collector_tasks : Dict[str, asyncio.Task]
+            タスク名をkey, 実行中のタスクをvalueとするdict。作り直したタスクで更新される
+        """
+        error : Optional[BaseException] = None
+        for name, task in collector_tasks.items():
+            if task.done() and not task.cancelled() and task.exception() is not None:
+                error = task.exception()
+                logger.error(f'Collector task stopped: {name}. Restarting.', exc_info=error)
+                collector_tasks[name] = asyncio.create_task(collectors[name]())
+        if error is not None:
+            raise error
 
     def _create_ohlcvs(self) -> Dict[str, Ohlcv]:
         """貯められた各取引所の約定履歴をohlcvに変換する。１件も無い場合はプロパティがNoneのohlcvを作成
@@ -386,13 +661,15 @@ class ApiClient:
         Dict[str, Ohlcv]
             取引所をkey, ohlcvをvalueとするdict
         """
+        trading_history_storage : TradingHistoryStorage = self.trading_history_storage
         ohlcv_dict : Dict[str, Ohlcv] = {}
         for exchange in params.EXCHANGES:
-            contract_prices : List[ContractPrice] = self.trading_history_storage.contract_prices_dict[exchange]
-            buy_volume : float = self.trading_history_storage.buy_volume_dict[exchange]
-            sell_volume : float = self.trading_history_storage.sell_volume_dict[exchange]
-            if len(contract_prices) != 0:
-                ohlcv : Ohlcv = Ohlcv(cps=contract_prices, buy_volume=buy_volume, sell_volume=sell_volume)
+            prices : array = trading_history_storage.prices_dict[exchange]
+            sides : array = trading_history_storage.sides_dict[exchange]
+            buy_volume : float = trading_history_storage.buy_volume_dict[exchange]
+            sell_volume : float = trading_history_storage.sell_volume_dict[exchange]
+            if len(prices) != 0:
+                ohlcv : Ohlcv = Ohlcv(prices=prices, sides=sides, buy_volume=buy_volume, sell_volume=sell_volume)
             else:
                 ohlcv : Ohlcv = Ohlcv()  # 約定が一つも無かった場合
             ohlcv_dict[exchange] = ohlcv
@@ -406,10 +683,11 @@ class ApiClient:
         Dict[str, LiquidationQty]
             取引所をkey, LiquidationQtyをvalueとするdict
         """
+        trading_history_storage : TradingHistoryStorage = self.trading_history_storage
         liquidation_qty_dict : Dict[str, LiquidationQty] = {}
         for exchange in params.EXCHANGES:
-            buy_liquidation_qty : float = self.trading_history_storage.buy_liquidation_qty_dict[exchange]
-            sell_liquidation_qty : float = self.trading_history_storage.sell_liquidation_qty_dict[exchange]
+            buy_liquidation_qty : float = trading_history_storage.buy_liquidation_qty_dict[exchange]
+            sell_liquidation_qty : float = trading_history_storage.sell_liquidation_qty_dict[exchange]
             liquidation_qty : LiquidationQty = LiquidationQty(buy_liq_qty=buy_liquidation_qty, sell_liq_qty=sell_liquidation_qty)
             liquidation_qty_dict[exchange] = liquidation_qty
         return liquidation_qty_dict
@@ -422,9 +700,10 @@ class ApiClient:
         Dict[str, OIohlc]
             取引所をkey, 未決済建玉数ohlcをvalueとするdict
         """
+        OIs_dict : Dict[str, array] = self.trading_history_storage.OIs_dict
         oi_ohlc_dict : Dict[str, OIohlc] = {}
         for exchange in params.EXCHANGES:
-            ois : List[float] = self.trading_history_storage.OIs_dict[exchange]
+            ois : array = OIs_dict[exchange]
             if len(ois) != 0:
                 oi_ohlc : OIohlc = OIohlc(ois=ois)
             else:
@@ -432,25 +711,89 @@ class ApiClient:
             oi_ohlc_dict[exchange] = oi_ohlc
         return oi_ohlc_dict
 
-    def save_ticker(self) -> None:
-        """dfを日が変わるごとにGCSに書き出し、初期化する"""
+    async def save_ticker(self) -> None:
+        """dfをGCSに書き出し、初期化する。書き出しは別スレッドで行い、イベントループをブロックしない。
+        以前にアップロードに失敗したレコードがあれば、それも合わせて書き出す"""
+        self._stash_buffers()
+        await self._upload_pending()
 
-        def inner_upload_df_to_gcs(df: pd.DataFrame, exchange: str) -> None:
-            """GCSにdfをアップロードする"""
-            temp_filepath : str = os.path.join(params.SAVE_DIR, f'temp_{exchange}.pkl.bz2')
-            df.to_pickle(temp_filepath, compression='bz2')  # ローカルにdfを一時書き出し
-            blob : storage.Blob = self.gcs_bucket.blob(os.path.join(params.SAVE_DIR, f'{self.today.strftime("%Y%m%d")}_{exchange}.pkl.bz2'))
-            blob.upload_from_filename(temp_filepath)  # GCSにdfをアップロード
+    def _stash_buffers(self) -> None:
+        """溜めたレコードを日付とともに退避し、初期化する。以降のレコードは新しいバッファに追加される"""
+        self.pending_buffer_dicts[self.today] = self.buffer_dict
+        self.buffer_dict : Dict[str, TickerBuffer] = {exchange: TickerBuffer() for exchange in params.EXCHANGES}
 
-        # GCSにdfをアップロード
-        for exchange in params.EXCHANGES:
-            inner_upload_df_to_gcs(df=self.df_dict[exchange], exchange=exchange)
-        logger.info(f'Uploaded ticker datas to GCS. DATE: {self.today}')
-        # GCSにlogをアップロード
+    async def _upload_pending(self) -> None:
+        """退避したレコードを日付順に、別スレッドでGCSにアップロードする。
+        アップロードが成功した日付のレコードのみ破棄し、失敗した場合は残りのレコードを保持したまま例外を送出する"""
+        while self.pending_buffer_dicts:
+            day : date = min(self.pending_buffer_dicts)
+            await asyncio.to_thread(self._upload_ticker, buffer_dict=self.pending_buffer_dicts[day], today=day)
+            del self.pending_buffer_dicts[day]
+
+    def _upload_ticker(self, buffer_dict: Dict[str, TickerBuffer], today: date) -> None:
+        """溜めたレコードをdfに変換し、GCSにアップロードする
+
+        Parameters
+        ----------
+        buffer_dict : Dict[str, TickerBuffer]
+            取引所をkey, 取引情報のレコードを溜めたバッファをvalueとするdict
+        today : date
+            レコードの日付
+        """
+
+        def inner_upload_df_to_gcs(exchange: str) -> None:
+            """溜めたレコードをdfに変換し、GCSにアップロードする。通常はローカルに書き出さず、メモリ上のバッファから直接アップロード。
+            失敗した場合は再送できるようSAVE_DIRに書き出してから例外を送出"""
+            df : pd.DataFrame = buffer_dict[exchange].to_dataframe()
+            suffix : str = 'parquet' if params.SAVE_FORMAT == 'parquet' else 'pkl.zst'
+            filepath : str = os.path.join(params.SAVE_DIR, f'{today.strftime("%Y%m%d")}_{exchange}.{suffix}')
+            buffer : io.BytesIO = io.BytesIO()
+            serialized : bool = False
+            try:
+                if params.SAVE_FORMAT == 'parquet':
+                    df.to_parquet(buffer, engine='pyarrow', compression='zstd')
+                else:
+                    df.to_pickle(buffer, compression={'method': 'zstd', 'level': 3})
+                serialized = True
+                blob : storage.Blob = self.gcs_bucket.blob(filepath)
+                blob.upload_from_file(buffer, rewind=True)  # GCSにdfをアップロード
+            except Exception:
+                if serialized:  # アップロードに失敗した場合は、書き出し済みのバイト列をそのまま保存
+                    with open(filepath, 'wb') as f:
+                        f.write(buffer.getbuffer())
+                else:  # 書き出しに失敗した場合は、dfをpickleで保存
+                    filepath = os.path.join(params.SAVE_DIR, f'{today.strftime("%Y%m%d")}_{exchange}.pkl.zst')
+                    df.to_pickle(filepath, compression={'method': 'zstd', 'level': 3})
+                logger.warn(f'Failed to upload ticker datas to GCS. Saved locally: {filepath}')
+                raise
+
+        # 取引所ごとの圧縮とアップロードを並列に行う。例外はlistで結果を取り出す際に送出される
+        with ThreadPoolExecutor(max_workers=len(params.EXCHANGES)) as executor:
+            list(executor.map(inner_upload_df_to_gcs, params.EXCHANGES))
+        logger.info(f'Uploaded ticker datas to GCS. DATE: {today}')
+        # GCSにlogをアップロード。キューに残っているログを先にファイルへ書き出す
+        logger.flush()
         blob : storage.Blob = self.gcs_bucket.blob(logger.log_file_path)
         blob.upload_from_filename(logger.log_file_path)
-        # df初期化
-        self.df_dict : Dict[str, pd.DataFrame] = {exchange: pd.DataFrame(columns=params.COLUMNS) for exchange in params.EXCHANGES}
+
+    def _cal_next_tick(self, last_tick: Optional[float] = None) -> float:
+        """次にtickを記録する時刻 (UNIX時間) を計算。前回のtickの5秒後とし、
+        前回のtickが無い場合や処理の遅れで既に過ぎている場合は、現在時刻より後の次のキリの良い時間 (5秒毎) とする
+
+        Parameters
+        ----------
+        last_tick : float | None
+            前回のtickの時刻 (UNIX時間)
+
+        Returns
+        -------
+        float
+            次のtickの時刻 (UNIX時間)
+        """
+        now : float = time.time()
+        if last_tick is not None and last_tick + 5.0 > now:
+            return last_tick + 5.0
+        return now - now % 5.0 + 5.0
 
     def _has_update(self) -> bool:
         """各取引所の情報が取得できたか
@@ -462,25 +805,24 @@ class ApiClient:
         """
 
         def inner_check_element(arg, *args) -> bool:
-            has_element : bool = True
-            args = (arg, ) + args
-            for arg in args:
+            """全ての要素が空でないか。空の要素が見つかった時点でFalseを返す"""
+            for arg in (arg, ) + args:
                 try:
-                    has_element &= False if len(arg) == 0 else True
+                    if len(arg) == 0:
+                        return False
                 except TypeError:
-                    has_element &= False
-            return has_element
+                    return False
+            return True
 
-        has_updated : bool = True
         for exchange in params.EXCHANGES:
             orderbook = self.store_dict[exchange].orderbook
             try:
                 trade = self.store_dict[exchange].trade
             except AttributeError:
                 trade = self.store_dict[exchange].trades
-            has_updated &= inner_check_element(orderbook, trade)
-            
-        return has_updated
+            if not inner_check_element(orderbook, trade):
+                return False  # 未取得の取引所があれば残りは確認しない
+        return True
 
     def _parse_orderbook(self, orderbook: List[dict]) -> Dict[str, List[Dict[str, float]]]:
         """APIで取得した板情報をパース
@@ -496,17 +838,16 @@ class ApiClient:
             パース後の板情報
         """
         result = {'Buy': [], 'Sell': []}
-        wanted_keys = ['size', 'price']
-        for dict_ in deepcopy(orderbook):
-            side : str = dict_['side'].capitalize()  # 一文字目だけを大文字
-            dict_ : dict = extract_dict(dict_, wanted_keys)
-            result[side].append(dict_)
-        result['Sell'].sort(key=lambda x: x['price'])
-        result['Buy'].sort(key=lambda x: x['price'], reverse=True)
+        for dict_ in orderbook:
+            side : str = 'Buy' if dict_['side'][0] in 'Bb' else 'Sell'
+            # DataStoreのdictはコピーせず、必要なkeyのみで新たなdictを作成
+            result[side].append({'price': dict_['price'], 'size': dict_['size']})
+        result['Sell'].sort(key=itemgetter('price'))
+        result['Buy'].sort(key=itemgetter('price'), reverse=True)
         return result
 
     def _update_df(self, now: date, ticker_dict: Dict[str, Ticker]) -> None:
-        """dfにレコードを追加
+        """レコードを追加。dfへの変換は保存時にまとめて行う
 
         Parameters
         ----------
@@ -515,9 +856,22 @@ class ApiClient:
         ticker_dict : Dict[str, Ticker]
             取引所をkey, 取引情報であるtickerをvalueとするdict
         """
+
+        def inner_schedule_retry(task: asyncio.Task) -> None:
+            """アップロードに失敗した場合にログを出力し、再試行の時刻を設定。退避したレコードは破棄せずに保持する"""
+            if not task.cancelled() and task.exception() is not None:
+                logger.error(f'Failed to upload ticker datas to GCS. Retry in {params.UPLOAD_RETRY_INTERVAL} seconds: {task.exception()}', exc_info=task.exception())
+                self.upload_retry_time = time.time() + params.UPLOAD_RETRY_INTERVAL
+
         if now > self.today:  # 日付が変わった場合
-            self.save_ticker()  # dfの保存 & 初期化
+            self._stash_buffers()  # dfの退避 & 初期化
             self.today = now  # 日付更新
-        # df更新
+        # 退避したレコードがあればアップロードを開始。完了は待たずに次のtickの取得を続ける
+        if (self.pending_buffer_dicts
+                and (self.upload_task is None or self.upload_task.done())
+                and time.time() >= self.upload_retry_time):
+            self.upload_task : Optional[asyncio.Task] = asyncio.create_task(self._upload_pending())
+            self.upload_task.add_done_callback(inner_schedule_retry)
+        # レコード追加
         for exchange in params.EXCHANGES:
-            self.df_dict[exchange] = self.df_dict[exchange].append(ticker_dict[exchange].__dict__, ignore_index=True)
\ No newline at end of file
+            self.buffer_dict[exchange].append(ticker_dict[exchange])
\ No newline at end of file